@@ -2,17 +2,24 @@
 
 from __future__ import annotations
 
+import os
+import platform
+import shutil
+import subprocess
+from copy import deepcopy
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 
 import pytest
 from _pytest.assertion import truncate
 from cryptography import x509
+from cryptography.hazmat.backends.openssl import backend as openssl_backend
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from faker import Faker
 from saml2 import BINDING_HTTP_POST, BINDING_HTTP_REDIRECT
+from saml2.client import Saml2Client
 from saml2.config import Config, IdPConfig
 from saml2.metadata import create_metadata_string
 from saml2.saml import (
@@ -20,18 +27,122 @@ from saml2.saml import (
     NAMEID_FORMAT_PERSISTENT,
     NAMEID_FORMAT_TRANSIENT,
 )
+from saml2.server import Server
 
 # Increase the long string truncation limit when running pytest in
 # verbose mode; cf. https://stackoverflow.com/a/60321834.
 truncate.DEFAULT_MAX_LINES = 999999
 truncate.DEFAULT_MAX_CHARS = 999999
 
+# Mock keying material secures nothing, so favor fast key generation
+# over key strength.  Faster algorithms like Ed25519 are out: pysaml2
+# has no EdDSA signature algorithm, and pyXMLSecurity only implements
+# RSA and ECDSA signing.  Set MOCK_SAML_FLOW_KEY_SIZE=2048 (or larger)
+# to test with production-strength keys.
+DEFAULT_KEY_SIZE = 1024
+key_size_key = pytest.StashKey[int]()
 
-def generate_key_pair() -> Dict[str, str]:
-    """Return a self-signed X.509 certificate and private key."""
+# Sign and verify XML using xmlsec1, which does canonicalization and
+# cryptography in C, if available.  Otherwise, fall back to
+# pyXMLSecurity's pure Python implementation, which only supports
+# XML-DSIG (not XML encryption).  Set
+# MOCK_SAML_FLOW_CRYPTO_BACKEND=xmlsec1 or XMLSecurity to force one or
+# the other.
+CRYPTO_BACKENDS = ("xmlsec1", "XMLSecurity")
+crypto_backend_key = pytest.StashKey[Tuple[str, Optional[str]]]()
+
+
+def pytest_configure(config: pytest.Config):
+    """Read the mock keying material's RSA key size and the pysaml2
+    crypto back end from the environment.
+
+    """
+    value = os.environ.get("MOCK_SAML_FLOW_KEY_SIZE", str(DEFAULT_KEY_SIZE))
+    try:
+        key_size = int(value)
+    except ValueError:
+        key_size = 0
+
+    # cryptography refuses to generate RSA keys shorter than 1024 bits.
+    if key_size < 1024:
+        raise pytest.UsageError(
+            "MOCK_SAML_FLOW_KEY_SIZE must be an RSA key size of at least 1024"
+            f" bits, not {value!r}"
+        )
+    config.stash[key_size_key] = key_size
+
+    xmlsec_binary = shutil.which("xmlsec1")
+    backend = os.environ.get("MOCK_SAML_FLOW_CRYPTO_BACKEND", "")
+    if not backend:
+        backend = "xmlsec1" if xmlsec_binary else "XMLSecurity"
+    elif backend not in CRYPTO_BACKENDS:
+        raise pytest.UsageError(
+            "MOCK_SAML_FLOW_CRYPTO_BACKEND must be one of"
+            f" {', '.join(CRYPTO_BACKENDS)}, not {backend!r}"
+        )
+    elif backend == "xmlsec1" and not xmlsec_binary:
+        raise pytest.UsageError(
+            "MOCK_SAML_FLOW_CRYPTO_BACKEND=xmlsec1 requires xmlsec1 on the PATH"
+        )
+    config.stash[crypto_backend_key] = (
+        backend,
+        xmlsec_binary if backend == "xmlsec1" else None,
+    )
+
+
+def pytest_addoption(parser: pytest.Parser):
+    """Add command-line options for the mock SAML 2.0 flow."""
+    parser.addoption(
+        "--regen-keys",
+        action="store_true",
+        default=False,
+        help="regenerate the mock IdP and SP keying material instead of "
+        "reusing the copies saved in the pytest cache",
+    )
+
+
+def pytest_report_header(config: pytest.Config) -> List[str]:
+    """In verbose mode, report which pysaml2 crypto back end signs and
+    verifies XML, and whether SHA-256 hashing (used for certificate
+    signatures and XML-DSIG digests) can use the CPU's SHA extensions,
+    which OpenSSL selects at run time.
+
+    """
+    if config.get_verbosity() < 1:
+        return []
+    backend, xmlsec_binary = config.stash[crypto_backend_key]
+    if xmlsec_binary:
+        # pysaml2 invokes xmlsec1 1.2.x and 1.3.x differently.
+        try:
+            version = subprocess.run(
+                [xmlsec_binary, "--version"], capture_output=True, text=True
+            ).stdout.strip()
+        except OSError:
+            version = ""
+        backend = f"{backend} ({xmlsec_binary}, {version or 'unknown version'})"
+    sha_ni = "unknown"
+    if platform.system() == "Linux" and platform.machine() == "x86_64":
+        try:
+            with open("/proc/cpuinfo") as cpuinfo:
+                sha_ni = "yes" if "sha_ni" in cpuinfo.read().split() else "no"
+        except OSError:
+            pass
+    return [
+        f"pysaml2 crypto backend: {backend}",
+        f"cryptography: {openssl_backend.openssl_version_text()},"
+        f" CPU SHA extensions: {sha_ni}",
+    ]
+
+
+def generate_key_pair(key_size: int = DEFAULT_KEY_SIZE) -> Dict[str, bytes]:
+    """Return a self-signed X.509 certificate and private key.
+
+    :param key_size: The RSA modulus length in bits.
+
+    """
 
     # Generate the key pair first.
-    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
 
     # SAML does not use certificate name attributes.
     subject = issuer = x509.Name([])
@@ -50,31 +161,155 @@ def generate_key_pair() -> Dict[str, str]:
 
     # Return the certificate and key in PEM format.
     return {
-        "cert": cert.public_bytes(serialization.Encoding.PEM).decode("utf-8"),
+        "cert": cert.public_bytes(serialization.Encoding.PEM),
         "key": key.private_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PrivateFormat.TraditionalOpenSSL,
             encryption_algorithm=serialization.NoEncryption(),
-        ).decode("utf-8"),
+        ),
     }
 
 
-@pytest.fixture
-def saml2_idp_entityid(faker: Faker) -> str:
+def load_key_pair(cached: Any, key_size: int) -> Dict[str, bytes] | None:
+    """Validate a key pair read from the pytest cache.
+
+    :param cached: The cache entry, which should map "cert" and "key"
+        to PEM strings.
+    :param key_size: The expected RSA modulus length in bits.
+    :return: The certificate and key in PEM format, or None if the
+        entry is malformed, the key doesn't match the certificate or
+        has the wrong size, or the certificate has expired.
+
+    """
+    if not isinstance(cached, dict) or cached.keys() != {"cert", "key"}:
+        return None
+    try:
+        keymat = {k: v.encode("ascii") for k, v in cached.items()}
+        cert = x509.load_pem_x509_certificate(keymat["cert"])
+        key = serialization.load_pem_private_key(keymat["key"], password=None)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if (
+        not isinstance(key, rsa.RSAPrivateKey)
+        or key.key_size != key_size
+        or cert.public_key() != key.public_key()
+        or cert.not_valid_after_utc <= datetime.now(timezone.utc)
+    ):
+        return None
+    return keymat
+
+
+def cached_key_pair(config: pytest.Config, name: str) -> Dict[str, bytes]:
+    """Return a self-signed X.509 certificate and private key from the
+    pytest cache, generating and saving them on a cache miss.  Mock
+    keying material secures nothing, so there's no harm in reusing it
+    across test runs.
+
+    :param config: The pytest configuration, which provides access to
+        the cache and to the `--regen-keys` option.
+    :param name: Distinguishes one key pair from another.
+    :return: The certificate and key in PEM format.
+
+    """
+    key_size = config.stash[key_size_key]
+
+    # pytest's cache plugin may be disabled (`-p no:cacheprovider`).
+    cache = getattr(config, "cache", None)
+    if cache is None:
+        return generate_key_pair(key_size)
+
+    # Keep key pairs of different sizes separate.  The cache stores
+    # JSON, so convert PEM (which is ASCII) to and from strings.
+    cache_key = f"mock_saml_flow/{name}_keymat_{key_size}"
+    cached = None if config.getoption("regen_keys") else cache.get(cache_key, None)
+
+    # Regenerate stale or hand-edited entries instead of trusting them.
+    keymat = load_key_pair(cached, key_size)
+    if keymat is not None:
+        return keymat
+    keymat = generate_key_pair(key_size)
+    cache.set(cache_key, {k: v.decode("ascii") for k, v in keymat.items()})
+    return keymat
+
+
+def save_keymat(
+    directory: Path, prefix: str, keymat: Dict[str, bytes]
+) -> Tuple[Path, Path]:
+    """Write an entity's certificate and private key to disk.
+
+    :param directory: Where to save the keying material.
+    :param prefix: Distinguishes one entity's files from another's.
+    :param keymat: The certificate and key in PEM format.
+    :return: The pathnames of the certificate and key files.
+
+    """
+    cert_file = directory / f"{prefix}-cert.pem"
+    cert_file.write_bytes(keymat["cert"])
+    key_file = directory / f"{prefix}-key.pem"
+    key_file.write_bytes(keymat["key"])
+    return cert_file, key_file
+
+
+def save_metadata(config: Config, metadata_file: Path) -> Path:
+    """Write an entity's metadata document to disk.  The metadata
+    fixtures are session-scoped, so this happens once per entity per
+    test session.
+
+    :param config: The entity's loaded pysaml2 configuration.
+    :param metadata_file: Where to save the metadata document.
+    :return: The pathname of the metadata document.
+
+    """
+    metadata_file.write_bytes(create_metadata_string(None, config=config))
+    return metadata_file
+
+
+@pytest.fixture(scope="session")
+def shared_faker() -> Faker:
+    """Generate fake data for session-scoped fixtures, which can't use
+    the function-scoped `faker` fixture.  Seed it the same way the
+    Faker pytest plugin seeds `faker`, so that test runs are
+    reproducible.
+
+    """
+    fake = Faker()
+    fake.seed_instance(0)
+    return fake
+
+
+@pytest.fixture(scope="session")
+def saml2_idp_keymat(pytestconfig: pytest.Config) -> Dict[str, bytes]:
+    """Load the mock SAML 2.0 identity provider's keying material once
+    per test session.
+
+    """
+    return cached_key_pair(pytestconfig, "idp")
+
+
+@pytest.fixture(scope="session")
+def saml2_idp_entityid(shared_faker: Faker) -> str:
     """Uniquely identify a mock SAML 2.0 identity provider."""
-    return f"https://{faker.hostname()}/"
+    return f"https://{shared_faker.hostname()}/"
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def saml2_idp_config(
-    saml2_idp_entityid: str, tmp_path_factory: pytest.TempPathFactory
+    saml2_idp_entityid: str,
+    saml2_idp_keymat: Dict[str, bytes],
+    pytestconfig: pytest.Config,
+    tmp_path_factory: pytest.TempPathFactory,
 ) -> Dict[str, Any]:
     """Configure a mock SAML 2.0 identity provider (IdP).  Remember to
     add service provider metadata, whether to this configuration prior
     to starting the SP or afterwards via
     saml2.entity.Entity::reload_metadata().
 
-    :param saml2_idp_entityid: The mock SP entity ID.
+    The configuration is shared by the whole test session, so tests
+    must copy it before making changes.
+
+    :param saml2_idp_entityid: The mock IdP entity ID.
+    :param saml2_idp_keymat: The mock IdP keying material.
+    :param pytestconfig: Selects the crypto back end.
     :param tmp_path_factory: pysaml2 stores keying material on disk.
         These files must persist for the lifetime of the IdP
         configuration.
@@ -82,20 +317,17 @@ def saml2_idp_config(
     """
 
     # Save IdP keymat to disk.
-    idp_keymat = generate_key_pair()
-    cert_file = tmp_path_factory.getbasetemp() / "idp-cert.pem"
-    with cert_file.open("w") as cf:
-        cf.write(idp_keymat["cert"])
-    key_file = tmp_path_factory.getbasetemp() / "idp-key.pem"
-    with key_file.open("w") as kf:
-        kf.write(idp_keymat["key"])
+    cert_file, key_file = save_keymat(
+        tmp_path_factory.getbasetemp(), "idp", saml2_idp_keymat
+    )
+    crypto_backend, xmlsec_binary = pytestconfig.stash[crypto_backend_key]
 
     return {
         "entityid": saml2_idp_entityid,
-        "xmlsec_binary": None,
-        "crypto_backend": "XMLSecurity",  # NB: requires pyXMLSecurity; XML-DSIG only
-        "key_file": str(kf.name),
-        "cert_file": str(cf.name),
+        "xmlsec_binary": xmlsec_binary,
+        "crypto_backend": crypto_backend,
+        "key_file": str(key_file),
+        "cert_file": str(cert_file),
         "service": {
             "idp": {
                 "endpoints": {
@@ -132,7 +364,7 @@ def saml2_idp_config(
     }
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def saml2_idp_metadata(
     saml2_idp_config: Dict[str, Any], tmp_path_factory: pytest.TempPathFactory
 ) -> Path:
@@ -146,30 +378,45 @@ def saml2_idp_metadata(
     :return: The pathname of a file containing the mock IdP metadata.
 
     """
-    idp_metadata = tmp_path_factory.getbasetemp() / "idp-metadata.xml"
-    with idp_metadata.open("wb") as idpm:
-        idpm.write(
-            create_metadata_string(None, config=IdPConfig().load(saml2_idp_config))
-        )
-    return idp_metadata
+    return save_metadata(
+        IdPConfig().load(saml2_idp_config),
+        tmp_path_factory.getbasetemp() / "idp-metadata.xml",
+    )
+
+
+@pytest.fixture(scope="session")
+def saml2_sp_keymat(pytestconfig: pytest.Config) -> Dict[str, bytes]:
+    """Load the mock SAML 2.0 service provider's keying material once
+    per test session.
+
+    """
+    return cached_key_pair(pytestconfig, "sp")
 
 
-@pytest.fixture
-def saml2_sp_entityid(faker: Faker) -> str:
+@pytest.fixture(scope="session")
+def saml2_sp_entityid(shared_faker: Faker) -> str:
     """Uniquely identify a mock SAML 2.0 service provider."""
-    return f"https://{faker.hostname()}/"
+    return f"https://{shared_faker.hostname()}/"
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def saml2_sp_config(
-    saml2_sp_entityid: str, tmp_path_factory: pytest.TempPathFactory
+    saml2_sp_entityid: str,
+    saml2_sp_keymat: Dict[str, bytes],
+    pytestconfig: pytest.Config,
+    tmp_path_factory: pytest.TempPathFactory,
 ) -> Dict[str, Any]:
     """Configure a mock SAML 2.0 service provider (SP).  Remember to
     add identity provider metadata, whether to this configuration
     prior to starting the SP or afterwards via
     saml2.entity.Entity::reload_metadata().
 
+    The configuration is shared by the whole test session, so tests
+    must copy it before making changes.
+
     :param saml2_sp_entityid: The mock SP entity ID.
+    :param saml2_sp_keymat: The mock SP keying material.
+    :param pytestconfig: Selects the crypto back end.
     :param tmp_path_factory: pysaml2 stores keying material on disk.
         These files must persist for the lifetime of the SP
         configuration.
@@ -177,13 +424,10 @@ def saml2_sp_config(
     """
 
     # Save SP keymat to disk.
-    sp_keymat = generate_key_pair()
-    cert_file = tmp_path_factory.getbasetemp() / "sp-cert.pem"
-    with cert_file.open("w") as cf:
-        cf.write(sp_keymat["cert"])
-    key_file = tmp_path_factory.getbasetemp() / "sp-key.pem"
-    with key_file.open("w") as kf:
-        kf.write(sp_keymat["key"])
+    cert_file, key_file = save_keymat(
+        tmp_path_factory.getbasetemp(), "sp", saml2_sp_keymat
+    )
+    crypto_backend, xmlsec_binary = pytestconfig.stash[crypto_backend_key]
 
     # Build the SAML 2.0 assertion consumer service URL from the
     # entity ID.  Mind the path separators.
@@ -191,8 +435,8 @@ def saml2_sp_config(
 
     return {
         "entityid": saml2_sp_entityid,
-        "xmlsec_binary": None,
-        "crypto_backend": "XMLSecurity",  # NB: requires pyXMLSecurity; XML-DSIG only
+        "xmlsec_binary": xmlsec_binary,
+        "crypto_backend": crypto_backend,
         "key_file": str(key_file),
         "cert_file": str(cert_file),
         "service": {
@@ -206,7 +450,7 @@ def saml2_sp_config(
     }
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def saml2_sp_metadata(
     saml2_sp_config: Dict[str, Any], tmp_path_factory: pytest.TempPathFactory
 ) -> Path:
@@ -220,7 +464,47 @@ def saml2_sp_metadata(
     :return: The pathname of a file containing the mock SP metadata.
 
     """
-    sp_metadata = tmp_path_factory.getbasetemp() / "sp-metadata.xml"
-    with sp_metadata.open("wb") as spm:
-        spm.write(create_metadata_string(None, config=Config().load(saml2_sp_config)))
-    return sp_metadata
+    return save_metadata(
+        Config().load(saml2_sp_config),
+        tmp_path_factory.getbasetemp() / "sp-metadata.xml",
+    )
+
+
+@pytest.fixture(scope="session")
+def saml2_server(saml2_idp_config: Dict[str, Any], saml2_sp_metadata: Path) -> Server:
+    """Start a mock SAML 2.0 identity provider (IdP) that trusts the
+    mock service provider.  pysaml2 parses metadata and loads keying
+    material as it starts, so do this once per test session.
+
+    :param saml2_idp_config: The mock IdP configuration (a fixture).
+    :param saml2_sp_metadata: The mock SP metadata (a fixture).
+    :return: The mock IdP.
+
+    """
+
+    # Add the mock SP metadata to the mock IdP configuration.  Copy
+    # the configuration first, as the fixture is session-scoped.
+    config = deepcopy(saml2_idp_config)
+    config["metadata"] = {"local": [str(saml2_sp_metadata)]}
+    return Server(config=IdPConfig().load(config))
+
+
+@pytest.fixture(scope="session")
+def saml2_client(
+    saml2_sp_config: Dict[str, Any], saml2_idp_metadata: Path
+) -> Saml2Client:
+    """Start a mock SAML 2.0 service provider (SP) that trusts the
+    mock identity provider.  pysaml2 parses metadata and loads keying
+    material as it starts, so do this once per test session.
+
+    :param saml2_sp_config: The mock SP configuration (a fixture).
+    :param saml2_idp_metadata: The mock IdP metadata (a fixture).
+    :return: The mock SP.
+
+    """
+
+    # Add the mock IdP metadata to the mock SP configuration.  Copy
+    # the configuration first, as the fixture is session-scoped.
+    config = deepcopy(saml2_sp_config)
+    config["metadata"] = {"local": [str(saml2_idp_metadata)]}
+    return Saml2Client(config=Config().load(config))
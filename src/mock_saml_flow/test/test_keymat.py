@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+
+from mock_saml_flow.test.conftest import (
+    cached_key_pair,
+    generate_key_pair,
+    key_size_key,
+    load_key_pair,
+)
+
+CACHE_KEY = "mock_saml_flow/idp_keymat_1024"
+
+
+class StubCache:
+    """Stand in for pytest's cache, keeping entries in memory."""
+
+    def __init__(self, entries: Dict[str, Any] | None = None):
+        self.entries = dict(entries or {})
+
+    def get(self, key: str, default: Any) -> Any:
+        return self.entries.get(key, default)
+
+    def set(self, key: str, value: Any):
+        self.entries[key] = value
+
+
+def stub_config(cached: Any = None, regen_keys: bool = False) -> SimpleNamespace:
+    """Build just enough of a pytest configuration for
+    cached_key_pair().
+
+    """
+    config = SimpleNamespace(
+        cache=StubCache({} if cached is None else {CACHE_KEY: cached}),
+        getoption=lambda name: regen_keys,
+        stash=pytest.Stash(),
+    )
+    config.stash[key_size_key] = 1024
+    return config
+
+
+def as_entry(keymat: Dict[str, bytes]) -> Dict[str, str]:
+    """Convert keying material to the form saved in the cache."""
+    return {k: v.decode("ascii") for k, v in keymat.items()}
+
+
+def expired_key_pair() -> Dict[str, bytes]:
+    """Return a key pair whose certificate has already expired."""
+    keymat = generate_key_pair()
+    key = serialization.load_pem_private_key(keymat["key"], password=None)
+    not_valid_before = datetime.now(timezone.utc) - timedelta(days=2)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([]))
+        .issuer_name(x509.Name([]))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(not_valid_before)
+        .not_valid_after(not_valid_before + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return {"cert": cert.public_bytes(serialization.Encoding.PEM), "key": keymat["key"]}
+
+
+def test_cached_key_pair_reuses_valid_entry():
+    """Load a valid key pair from the cache instead of generating one."""
+    entry = as_entry(generate_key_pair())
+    config = stub_config(entry)
+    assert as_entry(cached_key_pair(config, "idp")) == entry
+    assert config.cache.entries[CACHE_KEY] == entry
+
+
+@pytest.mark.parametrize(
+    "make_entry",
+    [
+        pytest.param(lambda: ["cert", "key"], id="not-a-dict"),
+        pytest.param(
+            lambda: {"cert": as_entry(generate_key_pair())["cert"]}, id="missing-key"
+        ),
+        pytest.param(lambda: {"cert": 1, "key": 2}, id="not-strings"),
+        pytest.param(lambda: {"cert": "garbage", "key": "garbage"}, id="not-pem"),
+        pytest.param(
+            lambda: {
+                "cert": as_entry(generate_key_pair())["cert"],
+                "key": as_entry(generate_key_pair())["key"],
+            },
+            id="mismatched-key",
+        ),
+        pytest.param(lambda: as_entry(generate_key_pair(2048)), id="wrong-size"),
+        pytest.param(lambda: as_entry(expired_key_pair()), id="expired"),
+    ],
+)
+def test_cached_key_pair_replaces_bad_entry(make_entry: Callable[[], Any]):
+    """Regenerate and re-cache malformed or stale key pairs."""
+    entry = make_entry()
+    assert load_key_pair(entry, 1024) is None
+    config = stub_config(entry)
+    keymat = cached_key_pair(config, "idp")
+    assert load_key_pair(as_entry(keymat), 1024) == keymat
+    assert config.cache.entries[CACHE_KEY] == as_entry(keymat)
+
+
+def test_cached_key_pair_regen_keys():
+    """Replace a valid cached key pair when passed `--regen-keys`."""
+    entry = as_entry(generate_key_pair())
+    config = stub_config(entry, regen_keys=True)
+    keymat = cached_key_pair(config, "idp")
+    assert as_entry(keymat) != entry
+    assert config.cache.entries[CACHE_KEY] == as_entry(keymat)
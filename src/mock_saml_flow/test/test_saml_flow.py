@@ -1,8 +1,7 @@
-import random
-import string
-from html.parser import HTMLParser
-from pathlib import Path
-from typing import Any, Dict, List, Tuple
+import re
+import secrets
+from html import unescape
+from typing import Any, Dict, Tuple
 from urllib.parse import parse_qs, urlparse
 
 import pytest
@@ -11,44 +10,90 @@ from saml2 import BINDING_HTTP_POST, BINDING_HTTP_REDIRECT
 from saml2.assertion import Policy
 from saml2.authn_context import INTERNETPROTOCOLPASSWORD
 from saml2.client import Saml2Client
-from saml2.config import Config, IdPConfig
 from saml2.request import AuthnRequest
 from saml2.samlp import AuthnRequest as AuthnRequestElement
 from saml2.samlp import Response
 from saml2.server import Server
 from saml2.sigver import encrypt_cert_from_item
 
+# Match every input tag in an HTML form, capturing its attributes.
+# Skip over quoted attribute values, which may contain ">".
+_INPUT_RE = re.compile(r"""<input\b((?:[^>"']|"[^"]*"|'[^']*')*)>""", re.IGNORECASE)
 
-class Saml2AcsFormParser(HTMLParser):
-    """Extract the SAML response from an HTML form."""
+# Match an input tag's attributes, whether their values are double
+# quoted, single quoted, or unquoted.
+_ATTR_RE = re.compile(r"""([^\s=/>]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))""")
 
-    saml_response: str | None
-    relay_state: str | None
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.saml_response = None
-        self.relay_state = None
+def parse_acs_form(html: str) -> Tuple[str | None, str | None]:
+    """Extract the SAML response from an HTML form.
 
-    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Any]]):
-        """Retrieve the values of the `SAMLResponse` or the
-        `RelayState` input tags.
+    :param html: The HTML form submitted to the assertion consumer
+        service.
+    :return: The values of the `SAMLResponse` and `RelayState` input
+        tags, or None for any that are missing.
 
-        """
-        if "input" == tag.casefold():
-            # I don't know why attrs is a list of tuples, and at this
-            # point, I'm too afraid to ask.
-            attributes = dict(attrs)
-
-            # Skip this input tag if it doesn't have a name or a value
-            # attribute.
-            if "name" not in attributes or "value" not in attributes:
-                return
-
-            if "samlresponse" == attributes["name"].casefold():
-                self.saml_response = attributes["value"]
-            elif "relaystate" == attributes["name"].casefold():
-                self.relay_state = attributes["value"]
+    """
+    saml_response = relay_state = None
+    for input_tag in _INPUT_RE.finditer(html):
+        attributes = {
+            name.casefold(): unescape(dq or sq or uq)
+            for name, dq, sq, uq in _ATTR_RE.findall(input_tag.group(1))
+        }
+
+        # Skip this input tag if it doesn't have a name or a value
+        # attribute.
+        if "name" not in attributes or "value" not in attributes:
+            continue
+
+        if "samlresponse" == attributes["name"].casefold():
+            saml_response = attributes["value"]
+        elif "relaystate" == attributes["name"].casefold():
+            relay_state = attributes["value"]
+    return saml_response, relay_state
+
+
+@pytest.mark.parametrize(
+    ("html", "expected"),
+    [
+        pytest.param(
+            '<input name="SAMLResponse" value="abc"/>'
+            '<input name="RelayState" value="xyz"/>',
+            ("abc", "xyz"),
+            id="name-before-value",
+        ),
+        pytest.param(
+            '<input value="abc" name="SAMLResponse"/>'
+            '<input value="xyz" name="RelayState"/>',
+            ("abc", "xyz"),
+            id="value-before-name",
+        ),
+        pytest.param(
+            "<INPUT NAME='SAMLResponse' VALUE='abc'>"
+            "<input name=RelayState value=xyz>",
+            ("abc", "xyz"),
+            id="single-quoted-and-unquoted",
+        ),
+        pytest.param(
+            '<input name="RelayState" value="a&amp;b&#61;c"/>',
+            (None, "a&b=c"),
+            id="entity-escaped",
+        ),
+        pytest.param(
+            '<input name="RelayState" title="x>y" value="v"/>',
+            (None, "v"),
+            id="angle-bracket-in-value",
+        ),
+        pytest.param(
+            '<input type="submit" value="Continue"/>',
+            (None, None),
+            id="missing",
+        ),
+    ],
+)
+def test_parse_acs_form(html: str, expected: Tuple[str | None, str | None]):
+    """Extract the SAML response and relay state from HTML forms."""
+    assert parse_acs_form(html) == expected
 
 
 @pytest.mark.order("first")
@@ -56,29 +101,20 @@ class Saml2AcsFormParser(HTMLParser):
 def test_saml_flow(
     faker: Faker,
     saml2_idp_entityid: str,
-    saml2_idp_config: Dict[str, Any],
-    saml2_idp_metadata: Path,
+    saml2_server: Server,
     saml2_sp_entityid: str,
-    saml2_sp_config: Dict[str, Any],
-    saml2_sp_metadata: Path,
+    saml2_client: Saml2Client,
 ):
     """Log into a mock SAML 2.0 service provider (SP) using a mock
     SAML 2.0 identity provider (IdP).
 
     """
 
-    # Add the mock SP metadata to the mock IdP configuration.
-    saml2_idp_config["metadata"] = {"local": [str(saml2_sp_metadata)]}
-
-    # Add the mock IdP metadata to the mock SP configuration.
-    saml2_sp_config["metadata"] = {"local": [str(saml2_idp_metadata)]}
-
     # Request authentication.  The SP will redirect to the IdP.
     # Include a random relay state.
-    relay_state = "".join(random.sample(string.ascii_letters, 8))
-    client = Saml2Client(config=Config().load(saml2_sp_config))
+    relay_state = secrets.token_urlsafe(6)
     request_id, request_binding, request_http_args = (
-        client.prepare_for_negotiated_authenticate(
+        saml2_client.prepare_for_negotiated_authenticate(
             entity_id=saml2_idp_entityid, relay_state=relay_state
         )
     )
@@ -101,13 +137,14 @@ def test_saml_flow(
     assert encoded_relay_state
 
     # Parse the authentication request.
-    server = Server(config=IdPConfig().load(saml2_idp_config))
-    saml_request = server.parse_authn_request(encoded_saml_request, request_binding)
+    saml_request = saml2_server.parse_authn_request(
+        encoded_saml_request, request_binding
+    )
     assert isinstance(saml_request, AuthnRequest)
     authn_req: AuthnRequestElement = saml_request.message
 
     # Determine to whom to respond.
-    sp_info = server.response_args(authn_req)
+    sp_info = saml2_server.response_args(authn_req)
     for key in [
         "binding",
         "destination",
@@ -122,7 +159,7 @@ def test_saml_flow(
     assert sp_info["destination"].startswith(saml2_sp_entityid)
 
     # Determine how to sign/encrypt the response.
-    policy: Policy = server.config.getattr("policy")
+    policy: Policy = saml2_server.config.getattr("policy")
     assert policy
     sign_response = policy.get("sign_response", sp_info["sp_entity_id"])
     assert sign_response is not None
@@ -136,10 +173,10 @@ def test_saml_flow(
     )
 
     # Respond to the authentication request.
-    saml_response: Response = server.create_authn_response(
+    saml_response: Response = saml2_server.create_authn_response(
         authn={
             "class_ref": INTERNETPROTOCOLPASSWORD,
-            "authn_auth": server.config.entityid,
+            "authn_auth": saml2_server.config.entityid,
         },
         identity={
             "givenName": [faker.first_name()],
@@ -156,7 +193,7 @@ def test_saml_flow(
     assert saml_response
 
     # Encode the response in an HTML form.
-    http_args: Dict[str, Any] = server.apply_binding(
+    http_args: Dict[str, Any] = saml2_server.apply_binding(
         sp_info["binding"],
         f"{saml_response}",
         sp_info["destination"],
@@ -167,13 +204,12 @@ def test_saml_flow(
 
     # At this point, a web browser would submit the authentication
     # response to the SP, so extract it from the HTML form.
-    form_data = Saml2AcsFormParser()
-    form_data.feed(http_args["data"])
-    assert form_data.saml_response
-    assert form_data.relay_state == relay_state
+    form_saml_response, form_relay_state = parse_acs_form(http_args["data"])
+    assert form_saml_response
+    assert form_relay_state == relay_state
 
     # Parse the authentication response.
-    authn_response = client.parse_authn_request_response(
-        form_data.saml_response, BINDING_HTTP_POST, outstanding_queries
+    authn_response = saml2_client.parse_authn_request_response(
+        form_saml_response, BINDING_HTTP_POST, outstanding_queries
     )
     assert authn_response